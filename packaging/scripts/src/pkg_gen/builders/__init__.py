@@ -3,22 +3,62 @@
 
 from __future__ import annotations
 
+import fcntl
+import io
+import os
+import shlex
 import subprocess
-import shutil
-import hashlib
+import tarfile
 from pathlib import Path
-from typing import Protocol
-import requests
+from typing import BinaryIO, Callable, Iterator, Protocol
 
 from pkg_gen.errors import (
     BuildError,
     ConfigError,
     ValidationError,
     UnsupportedDistributionError,
-    DownloadError,
 )
 from pkg_gen.metadata import PackageMetadata
 from pkg_gen.builders.arch_builder import ArchBuilder
+from pkg_gen.utils.command import require_tool, run_logged
+
+_AR_MAGIC = b"!<arch>\n"
+_AR_HEADER_SIZE = 60
+
+
+def _iter_ar_members(fp: BinaryIO) -> Iterator[tuple[str, int]]:
+    """
+    Yield (name, size) for each member of an ar archive.
+    While the caller holds a member, fp is positioned at the start of its data.
+    Raises ValueError if the archive is malformed.
+    """
+    if fp.read(len(_AR_MAGIC)) != _AR_MAGIC:
+        raise ValueError("not an ar archive")
+    while header := fp.read(_AR_HEADER_SIZE):
+        if len(header) != _AR_HEADER_SIZE or header[58:60] != b"`\n":
+            raise ValueError("truncated ar member header")
+        name = header[:16].decode("ascii").rstrip().rstrip("/")
+        size = int(header[48:58])
+        start = fp.tell()
+        yield name, size
+        # Member data is padded to an even offset
+        fp.seek(start + size + (size & 1))
+
+
+def _find_one(dirpath: Path | str, prefix: str, suffix: str) -> Path | None:
+    """
+    Return the first entry in dirpath whose name has the given prefix and suffix.
+    Returns None when nothing matches or dirpath does not exist.
+    """
+    try:
+        with os.scandir(dirpath) as it:
+            for entry in it:
+                name = entry.name
+                if name.endswith(suffix) and name.startswith(prefix):
+                    return Path(entry.path)
+    except FileNotFoundError:
+        pass
+    return None
 
 
 class PackageBuilder(Protocol):
@@ -55,6 +95,7 @@ class DebianBuilder:
         self._project_root = project_root
         self._dist_name = dist_name
         self._build_dir = project_root / "packaging" / "build" / dist_name
+        self._tool_cargo = require_tool("cargo")
 
     @property
     def project_root(self) -> Path:
@@ -74,124 +115,55 @@ class DebianBuilder:
             raise ConfigError(f"Cargo.deb.toml not found at {config_path}")
 
         try:
-            subprocess.run(
-                ["cargo", "deb"],
-                cwd=self.project_root,
-                check=True,
-                capture_output=True,
-                text=True,
+            run_logged(
+                [
+                    self._tool_cargo,
+                    "deb",
+                    "--manifest-path",
+                    self.project_root / "Cargo.toml",
+                ],
+                self.build_dir / "build.log",
             )
         except subprocess.CalledProcessError as e:
             raise BuildError(f"Failed to build Debian package: {e.stdout}") from e
 
-        try:
-            return next(self.build_dir.glob("*.deb"))
-        except StopIteration:
+        package_path = _find_one(self.build_dir, "", ".deb")
+        if package_path is None:
             raise BuildError("No .deb package was generated")
+        return package_path
 
     def verify(self, package_path: Path) -> None:
+        debian_binary = None
+        control: tuple[str, bytes] | None = None
+        has_data = False
         try:
-            subprocess.run(
-                ["dpkg-deb", "--info", package_path],
-                check=True,
-                capture_output=True,
-                text=True,
-            )
-        except subprocess.CalledProcessError as e:
-            raise ValidationError(f"Invalid Debian package: {e.stdout}")
-
-
-'''
-class ArchBuilder:
-    """Builder for Arch Linux packages using makepkg."""
-
-    def __init__(self, project_root: Path, dist_name: str):
-        self._project_root = project_root
-        self._dist_name = dist_name
-        self._build_dir = project_root / "packaging" / "build" / dist_name
-
-    @property
-    def project_root(self) -> Path:
-        return self._project_root
-
-    @property
-    def dist_name(self) -> str:
-        return self._dist_name
-
-    @property
-    def build_dir(self) -> Path:
-        return self._build_dir
-
-    def _download_release(self, metadata: PackageMetadata) -> tuple[Path, str]:
-        """Download release and return (tarball_path, sha512sum)."""
-        url = f"{metadata.repo_url}/archive/refs/tags/" f"v{metadata.version}.tar.gz"
-
+            with open(package_path, "rb") as fp:
+                for name, size in _iter_ar_members(fp):
+                    if name == "debian-binary":
+                        debian_binary = fp.read(size)
+                    elif name.startswith("control.tar"):
+                        control = (name, fp.read(size))
+                    elif name.startswith("data.tar"):
+                        has_data = True
+        except (OSError, ValueError) as e:
+            raise ValidationError(f"Invalid Debian package: {e}") from e
+
+        if debian_binary != b"2.0\n":
+            raise ValidationError("Invalid Debian package: unsupported format version")
+        if control is None or not has_data:
+            raise ValidationError("Invalid Debian package: missing control or data archive")
+
+        control_name, control_data = control
+        if control_name.endswith(".zst"):
+            # tarfile cannot read zstd members before Python 3.14
+            return
         try:
-            response = requests.get(url, timeout=30)
-            response.raise_for_status()
-        except requests.RequestException as e:
-            raise DownloadError(f"Failed to download release: {e}") from e
-
-        # Calculate checksum first
-        sha512 = hashlib.sha512()
-        sha512.update(response.content)
-        checksum = sha512.hexdigest()
-
-        # Save the file
-        tarball = self.build_dir / f"{metadata.package_name}-{metadata.version}.tar.gz"
-        tarball.write_bytes(response.content)
-
-        return tarball, checksum
-
-    def build(self, metadata: PackageMetadata) -> Path:
-        pkgbuild_path = self.build_dir / "PKGBUILD"
-        if not pkgbuild_path.exists():
-            raise ConfigError(f"PKGBUILD not found at {pkgbuild_path}")
-
-        # Download source and get checksum before building
-        try:
-            _, checksum = self._download_release(metadata)
-            # Update PKGBUILD with the correct checksum
-            content = pkgbuild_path.read_text()
-            content = content.replace(
-                "sha512sums=('None')", f"sha512sums=('{checksum}')"
-            )
-            pkgbuild_path.write_text(content)
-        except DownloadError as e:
-            raise BuildError(f"Failed to prepare package: {e}") from e
-
-        try:
-            # Build the package using makepkg
-            subprocess.run(
-                ["makepkg", "-f", "--noconfirm"],
-                cwd=self.build_dir,
-                check=True,
-                capture_output=True,
-                text=True,
-            )
-        except subprocess.CalledProcessError as e:
-            raise BuildError(f"Failed to build Arch package: {e.stdout}") from e
-
-        try:
-            return next(
-                self.build_dir.glob(
-                    f"{metadata.package_name}-{metadata.version}*.pkg.tar.zst"
-                )
-            )
-        except StopIteration:
-            raise BuildError("No .pkg.tar.zst package was generated")
-
-    def verify(self, package_path: Path) -> None:
-        try:
-            subprocess.run(
-                ["pacman", "-Qp", package_path],
-                check=True,
-                capture_output=True,
-                text=True,
-            )
-        except subprocess.CalledProcessError as e:
-            raise ValidationError(f"Invalid Arch package: {e.stdout}")
-'''
+            with tarfile.open(fileobj=io.BytesIO(control_data)) as tf:
+                names = tf.getnames()
+        except tarfile.TarError as e:
+            raise ValidationError(f"Invalid Debian package: {e}") from e
+        if "./control" not in names and "control" not in names:
+            raise ValidationError("Invalid Debian package: control file is missing")
 
 
 class VoidBuilder:
@@ -202,6 +174,8 @@ class VoidBuilder:
         self._dist_name = f"void-{libc_variant}"
         self._build_dir = project_root / "packaging" / "build" / self._dist_name
         self.libc_variant = libc_variant
+        self._tool_sh = require_tool("sh")
+        self._tool_xbps_rindex = require_tool("xbps-rindex")
 
     @property
     def project_root(self) -> Path:
@@ -220,58 +194,61 @@ class VoidBuilder:
         if not template_path.exists():
             raise ConfigError(f"void template not found at {template_path}")
 
-        srcpkgs_dir = Path("/usr/src/void-packages/srcpkgs")
-        package_dir = srcpkgs_dir / metadata.package_name
-
-        try:
-            package_dir.mkdir(exist_ok=True)
-            shutil.copy2(template_path, package_dir / "template")
-        except OSError as e:
-            raise BuildError(f"Failed to set up Void package directory: {e}") from e
-
-        try:
-            subprocess.run(
-                ["./xbps-src", "pkg", metadata.package_name],
-                cwd="/usr/src/void-packages",
-                check=True,
-                capture_output=True,
-                text=True,
+        # One shell sets up srcpkgs and runs xbps-src instead of separate steps
+        package_dir = f"/usr/src/void-packages/srcpkgs/{metadata.package_name}"
+        script = " && ".join(
+            [
+                f"mkdir -p {shlex.quote(package_dir)}",
+                f"cp -p {shlex.quote(str(template_path))} "
+                f"{shlex.quote(package_dir + '/template')}",
+                "cd /usr/src/void-packages",
+                f"./xbps-src pkg {shlex.quote(metadata.package_name)}",
+            ]
+        )
+
+        # Both libc variants build in the same void-packages tree, so only one
+        # may write srcpkgs, run xbps-src and pick up its package at a time
+        lock_path = self.build_dir.parent / "void-packages.lock"
+        with open(lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                run_logged([self._tool_sh, "-c", script], self.build_dir / "build.log")
+            except subprocess.CalledProcessError as e:
+                raise BuildError(f"Failed to build Void package: {e.stdout}") from e
+
+            package_path = _find_one(
+                "/usr/src/void-packages/hostdir/binpkgs",
+                f"{metadata.package_name}-{metadata.version}_",
+                ".xbps",
             )
-        except subprocess.CalledProcessError as e:
-            raise BuildError(f"Failed to build Void package: {e.stdout}") from e
-
-        try:
-            return next(
-                Path("/usr/src/void-packages/hostdir/binpkgs").glob(
-                    f"{metadata.package_name}-*.xbps"
-                )
-            )
-        except StopIteration:
+        if package_path is None:
             raise BuildError("No .xbps package was generated")
+        return package_path
 
     def verify(self, package_path: Path) -> None:
         try:
-            subprocess.run(
-                ["xbps-rindex", "-v", package_path],
-                check=True,
-                capture_output=True,
-                text=True,
-            )
+            run_logged([self._tool_xbps_rindex, "-v", package_path], self.build_dir / "verify.log")
         except subprocess.CalledProcessError as e:
             raise ValidationError(f"Invalid Void package: {e.stdout}")
 
 
+_BUILDERS: dict[str, Callable[[Path, str], PackageBuilder]] = {
+    "deb": DebianBuilder,
+    "arch": ArchBuilder,
+}
+
+_VOID_PREFIX = "void-"
+
+
 def get_builder(dist_name: str, project_root: Path) -> PackageBuilder:
     """
     Factory function to get the appropriate builder.
     Raises UnsupportedDistributionError for unknown distributions.
     """
-    if dist_name == "deb":
-        return DebianBuilder(project_root, dist_name)
-    elif dist_name.startswith("void-"):
-        libc_variant = dist_name.split("-")[1]
+    factory = _BUILDERS.get(dist_name)
+    if factory is not None:
+        return factory(project_root, dist_name)
+    if dist_name.startswith(_VOID_PREFIX):
+        libc_variant = dist_name[len(_VOID_PREFIX) :]
         return VoidBuilder(project_root, dist_name, libc_variant)
-    elif dist_name == "arch":
-        return ArchBuilder(project_root, dist_name)
-    else:
-        raise UnsupportedDistributionError(f"Unsupported distribution: {dist_name}")
+    raise UnsupportedDistributionError(f"Unsupported distribution: {dist_name}")
@@ -1,19 +1,79 @@
 from __future__ import annotations
 
+import functools
 import os
 import hashlib
+import json
 import re
-import tempfile
+import shutil
+import subprocess
+import tarfile
 from pathlib import Path
-from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor
+from types import MappingProxyType
+from typing import TYPE_CHECKING, Mapping
 
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
-
-from pkg_gen.errors import BuildError, ConfigError, ValidationError
+from pkg_gen.errors import BuildError, ConfigError, DownloadError, ValidationError
 from pkg_gen.metadata import PackageMetadata
-from pkg_gen.utils.command import run_cmd, CommandError
+from pkg_gen.utils.command import run_cmd, run_logged, require_tool, CommandError
+
+if TYPE_CHECKING:
+    import requests
+
+_SESSION: requests.Session | None = None
+# Separate connect and read timeouts, in seconds
+_TIMEOUT = (5, 30)
+# Buffer size for streaming release tarballs to disk
+_IO_BUFFER = 1 << 20
+# PACKAGER line of makepkg.conf, whether set or commented out
+_PACKAGER_RE = re.compile(r"\s*#?PACKAGER=")
+# Checksum left for _prepare_build to fill in by the PKGBUILD template
+_SHA512SUMS_PLACEHOLDER_RE = re.compile(rb"sha512sums=\('None'\)")
+_BUILDINFO_REQUIRED_FIELDS = (
+    "format",
+    "pkgname",
+    "pkgver",
+    "pkgarch",
+    "packager",
+    "builddate",
+)
+
+
+def _session() -> requests.Session:
+    """Return the HTTP session shared by every builder in this process."""
+    global _SESSION
+    if _SESSION is None:
+        # Imported here so runs that never download don't pay for requests
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        retry_strategy = Retry(
+            total=5, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504]
+        )
+        _SESSION = requests.Session()
+        # Ask for unencoded bodies so a raw response stream is the file itself
+        _SESSION.headers["Accept-Encoding"] = "identity"
+        _SESSION.mount(
+            "https://",
+            HTTPAdapter(max_retries=retry_strategy, pool_connections=4, pool_maxsize=4),
+        )
+    return _SESSION
+
+
+@functools.lru_cache(maxsize=1)
+def _read_host_makepkg_settings() -> Mapping[str, str]:
+    """Read the host makepkg.conf settings carried into the chroot, once per process."""
+    settings: dict[str, str] = {}
+    try:
+        with open("/etc/makepkg.conf") as f:
+            for line in f:
+                line = line.strip()
+                if not line.startswith("#") and line.startswith("PACKAGER="):
+                    settings["PACKAGER"] = line.split("=", 1)[1].strip().strip('"')
+    except (OSError, IOError) as e:
+        raise BuildError(f"Failed to read host makepkg.conf: {e}")
+    return MappingProxyType(settings)
 
 
 class ArchBuilder:
@@ -23,12 +83,12 @@ class ArchBuilder:
         self._build_dir = project_root / "packaging" / "build" / dist_name
         self._output_dir = project_root / "packaging" / "dist" / dist_name
         self._chroot_path = project_root / "packaging" / "build" / "chroot"
-
-        retry_strategy = Retry(
-            total=5, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504]
+        self._checksum_cache_path = (
+            project_root / "packaging" / "build" / ".checksum-cache.json"
         )
-        self._session = requests.Session()
-        self._session.mount("https://", HTTPAdapter(max_retries=retry_strategy))
+        self._tool_pacman = require_tool("pacman")
+        self._tool_gpg = require_tool("gpg")
+        self._tool_zstd = require_tool("zstd")
 
     @property
     def project_root(self) -> Path:
@@ -44,14 +104,14 @@ class ArchBuilder:
 
     def _ensure_devtools_installed(self) -> None:
         try:
-            run_cmd(["pacman", "-Qi", "devtools"])
+            run_cmd([self._tool_pacman, "-Qi", "devtools"])
         except CommandError:
             raise BuildError(
                 "devtools is not installed. Please install it with: sudo pacman -S devtools"
             )
 
-    def _process_makepkg_line(self, line: str, settings: dict[str, str]) -> str:
-        if re.match(r"^(#)?PACKAGER=", line.strip()) and "PACKAGER" in settings:
+    def _process_makepkg_line(self, line: str, settings: Mapping[str, str]) -> str:
+        if "PACKAGER" in settings and _PACKAGER_RE.match(line):
             return f'PACKAGER="{settings["PACKAGER"]}"\n'
         return line
 
@@ -59,105 +119,169 @@ class ArchBuilder:
         if not makepkg_conf.exists():
             return
 
-        settings = {}
-        try:
-            with open("/etc/makepkg.conf") as f:
-                for line in f:
-                    line = line.strip()
-                    if not line.startswith("#") and line.startswith("PACKAGER="):
-                        settings["PACKAGER"] = line.split("=", 1)[1].strip().strip('"')
-        except (OSError, IOError) as e:
-            raise BuildError(f"Failed to read host makepkg.conf: {e}")
-
-        with ExitStack() as stack:
-            tmp = stack.enter_context(
-                tempfile.NamedTemporaryFile(mode="w", delete=False)
-            )
-            tmp_path = Path(tmp.name)
-            stack.callback(tmp_path.unlink)
+        settings = _read_host_makepkg_settings()
+        lines = makepkg_conf.read_text().splitlines(keepends=True)
+        new_lines = [self._process_makepkg_line(line, settings) for line in lines]
 
-            with open(makepkg_conf) as f:
-                new_lines = [self._process_makepkg_line(line, settings) for line in f]
-
-            tmp.write("".join(new_lines))
-            tmp.flush()
+        # Stream the new contents through sudo instead of staging a temporary copy
+        run_cmd(
+            ["sudo", "tee", makepkg_conf],
+            input="".join(new_lines).encode(),
+            capture=False,
+            stdout=subprocess.DEVNULL,
+        )
 
-            run_cmd(["sudo", "install", "-m", "644", tmp_path, makepkg_conf])
+    def _load_checksum_cache(self) -> dict[str, dict[str, str | int]]:
+        try:
+            with open(self._checksum_cache_path) as f:
+                cache = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return {}
+        return cache if isinstance(cache, dict) else {}
+
+    def _save_checksum_cache(self, cache: dict[str, dict[str, str | int]]) -> None:
+        tmp_path = self._checksum_cache_path.with_name(
+            self._checksum_cache_path.name + ".tmp"
+        )
+        tmp_path.write_text(json.dumps(cache, indent=2))
+        os.replace(tmp_path, self._checksum_cache_path)
 
     def _download_release(self, metadata: PackageMetadata) -> tuple[Path, str]:
         url = f"{metadata.repo_url}/archive/refs/tags/v{metadata.version}.tar.gz"
-        response = self._session.get(url, timeout=30)
-        response.raise_for_status()
+        tarball = self.build_dir / f"{metadata.package_name}-{metadata.version}.tar.gz"
+
+        cache = self._load_checksum_cache()
+        cached = cache.get(url)
+        headers: dict[str, str] = {}
+        if (
+            cached
+            and tarball.exists()
+            and tarball.stat().st_size == cached.get("size")
+        ):
+            headers["If-None-Match"] = str(cached["etag"])
+        else:
+            cached = None
+
         sha512 = hashlib.sha512()
-        sha512.update(response.content)
+        buf = bytearray(_IO_BUFFER)
+        view = memoryview(buf)
+        # Already loaded by _session(); needed here for the exception types
+        import requests
+        import urllib3.exceptions
+
+        try:
+            with _session().get(url, stream=True, timeout=_TIMEOUT, headers=headers) as response:
+                if cached and response.status_code == 304:
+                    return tarball, str(cached["sha512"])
+                response.raise_for_status()
+                with open(tarball, "wb", buffering=_IO_BUFFER) as f:
+                    # Bound once so the per-chunk loop skips attribute lookups
+                    readinto, update, write = response.raw.readinto, sha512.update, f.write
+                    while n := readinto(buf):
+                        chunk = view[:n]
+                        update(chunk)
+                        write(chunk)
+                etag = response.headers.get("ETag")
+        except (requests.RequestException, urllib3.exceptions.HTTPError) as e:
+            # Reads from response.raw raise urllib3 errors, not requests ones
+            raise DownloadError(f"Failed to download release: {e}") from e
+
         checksum = sha512.hexdigest()
-        tarball = self.build_dir / f"{metadata.package_name}-{metadata.version}.tar.gz"
-        tarball.write_bytes(response.content)
+        if etag:
+            cache[url] = {
+                "etag": etag,
+                "sha512": checksum,
+                "size": tarball.stat().st_size,
+            }
+            self._save_checksum_cache(cache)
         return tarball, checksum
 
     def _prepare_build(self, metadata: PackageMetadata) -> None:
-        self.build_dir.mkdir(parents=True, exist_ok=True)
+        # build() has already checked that the PKGBUILD exists
         pkgbuild_path = self.build_dir / "PKGBUILD"
-        if not pkgbuild_path.exists():
-            raise ConfigError(f"PKGBUILD not found at {pkgbuild_path}")
 
-        _, checksum = self._download_release(metadata)
-        content = pkgbuild_path.read_text()
-        content = content.replace("sha512sums=('None')", f"sha512sums=('{checksum}')")
-        pkgbuild_path.write_text(content)
+        tarball, checksum = self._download_release(metadata)
+        pkgbuild_path.write_bytes(
+            _SHA512SUMS_PLACEHOLDER_RE.sub(
+                f"sha512sums=('{checksum}')".encode(),
+                pkgbuild_path.read_bytes(),
+                count=1,
+            )
+        )
 
         if not pkgbuild_path.exists():
             raise BuildError("PKGBUILD file missing after preparation")
-        if not list(self.build_dir.glob("*.tar.gz")):
+        if not tarball.exists():
             raise BuildError("Source tarball missing after preparation")
 
     def _sign_package(self, package_path: Path) -> None:
         try:
-            run_cmd(["gpg", "--detach-sign", str(package_path)])
-            # Force a sync to ensure filesystem catches up
-            run_cmd(["sync"])
+            run_cmd([self._tool_gpg, "--detach-sign", str(package_path)])
 
-            sig_path = Path(str(package_path) + ".sig")
+            sig_path = package_path.with_name(package_path.name + ".sig")
             if not sig_path.exists():
                 raise BuildError(f"Signature file not found at {sig_path}")
         except CommandError as e:
             raise BuildError(f"Failed to sign package {package_path.name}: {e}")
 
-    def _extract_buildinfo(self, package_path: Path) -> None:
-        try:
-            run_cmd(
-                [
-                    "tar",
-                    "-C",
-                    str(package_path.parent),
-                    "-xf",
-                    str(package_path),
-                    ".BUILDINFO",
-                ]
-            )
-        except CommandError as e:
-            raise BuildError(
-                f"Failed to extract .BUILDINFO from {package_path.name}: {e}"
-            )
+    def _extract_buildinfo(self, package_path: Path) -> Path:
+        """
+        Write the package's .BUILDINFO next to it as <package>.buildinfo.
+        The archive is decompressed as a stream and only read up to that member,
+        which makepkg places at the start of the package.
+        """
+        buildinfo = None
+        with subprocess.Popen(
+            [self._tool_zstd, "-dc", str(package_path)],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        ) as zstd:
+            try:
+                with tarfile.open(fileobj=zstd.stdout, mode="r|") as tf:
+                    for member in tf:
+                        if member.name in (".BUILDINFO", "./.BUILDINFO"):
+                            f = tf.extractfile(member)
+                            if f is not None:
+                                buildinfo = f.read()
+                            break
+            except tarfile.TarError as e:
+                raise BuildError(
+                    f"Failed to extract .BUILDINFO from {package_path.name}: {e}"
+                ) from e
+            finally:
+                # The rest of the archive is not needed
+                zstd.kill()
+
+        if buildinfo is None:
+            raise BuildError(f"No .BUILDINFO found in {package_path.name}")
+        buildinfo_path = package_path.with_name(package_path.name + ".buildinfo")
+        buildinfo_path.write_bytes(buildinfo)
+        return buildinfo_path
 
     def _collect_outputs(self, metadata: PackageMetadata) -> list[Path]:
         self._output_dir.mkdir(parents=True, exist_ok=True)
 
+        # Same match as the glob "<package_name>*-<version>*.pkg.tar.zst"
+        prefix = metadata.package_name
+        infix = f"-{metadata.version}"
+        suffix = ".pkg.tar.zst"
+        with os.scandir(self.build_dir) as it:
+            packages = [
+                Path(entry.path)
+                for entry in it
+                if entry.name.startswith(prefix)
+                and entry.name.endswith(suffix)
+                and infix in entry.name[len(prefix) : -len(suffix)]
+            ]
+
         outputs = []
-        for pkg in self.build_dir.glob(
-            f"{metadata.package_name}*-{metadata.version}*.pkg.tar.zst"
-        ):
+        for pkg in packages:
             dest = self._output_dir / pkg.name
-            pkg.rename(dest)
+            os.replace(pkg, dest)
             outputs.append(dest)
             self._sign_package(dest)
-            self._extract_buildinfo(dest)
-
-            buildinfo_path = dest.parent / ".BUILDINFO"
-            if buildinfo_path.exists():
-                new_buildinfo = Path(str(dest) + ".buildinfo")
-                buildinfo_path.rename(new_buildinfo)
-                outputs.append(new_buildinfo)
+            outputs.append(self._extract_buildinfo(dest))
 
         if not outputs:
             raise BuildError("No packages were generated")
@@ -177,7 +301,11 @@ class ArchBuilder:
             pass
 
         if root_path.is_dir():
-            run_cmd(["sudo", "rm", "-rf", str(root_path)])
+            # The chroot belongs to root, so only root can remove it in-process
+            if os.geteuid() == 0:
+                shutil.rmtree(root_path)
+            else:
+                run_cmd(["sudo", "rm", "-rf", str(root_path)])
 
         lock_file = self._chroot_path / "root.lock"
         if lock_file.exists():
@@ -185,33 +313,48 @@ class ArchBuilder:
 
     def build(self, metadata: PackageMetadata) -> list[Path]:
         self._ensure_devtools_installed()
-        self._prepare_build(metadata)
+
+        # Fail before spending minutes on the chroot
+        self.build_dir.mkdir(parents=True, exist_ok=True)
+        pkgbuild_path = self.build_dir / "PKGBUILD"
+        if not pkgbuild_path.exists():
+            raise ConfigError(f"PKGBUILD not found at {pkgbuild_path}")
 
         env = os.environ.copy()
         env["CHROOT"] = str(self._chroot_path)
 
-        self._cleanup_chroot()
+        # Download the release while the chroot is being created
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            prepared = executor.submit(self._prepare_build, metadata)
 
-        try:
-            run_cmd(
-                ["mkarchroot", str(self._chroot_path / "root"), "base-devel"],
-                env=env,
-            )
-        except CommandError as e:
-            raise BuildError(f"Failed to create chroot: {e}")
+            self._cleanup_chroot()
+
+            try:
+                run_logged(
+                    ["mkarchroot", self._chroot_path / "root", "base-devel"],
+                    self.build_dir / "mkarchroot.log",
+                    env=env,
+                )
+            except subprocess.CalledProcessError as e:
+                raise BuildError(f"Failed to create chroot: {e.stdout}") from e
+
+            prepared.result()
 
         # Update makepkg.conf for PACKAGER setting
         makepkg_conf = self._chroot_path / "root" / "etc" / "makepkg.conf"
         self._update_makepkg_conf(makepkg_conf)
 
+        # Build output goes to a log: workers run side by side and serve
+        # replies on stdout
         try:
-            run_cmd(
+            run_logged(
                 ["extra-x86_64-build", "--"],
+                self.build_dir / "build.log",
                 cwd=self.build_dir,
                 env=env,
             )
-        except CommandError as e:
-            raise BuildError(f"Package build failed: {e}")
+        except subprocess.CalledProcessError as e:
+            raise BuildError(f"Package build failed: {e.stdout}") from e
 
         return self._collect_outputs(metadata)
 
@@ -221,53 +364,47 @@ class ArchBuilder:
         else:
             paths = package_paths
 
-        for package_path in paths:
-            if not str(package_path).endswith(".pkg.tar.zst"):
-                continue
-
-            try:
-                run_cmd(["pacman", "-Qp", str(package_path)])
-            except CommandError as e:
-                raise ValidationError(
-                    f"Package verification failed for {package_path.name}: {e}"
-                )
+        packages = [p for p in paths if p.name.endswith(".pkg.tar.zst")]
+        if not packages:
+            return
 
-            sig_path = Path(str(package_path) + ".sig")
+        signatures = []
+        for package_path in packages:
+            sig_path = package_path.with_name(package_path.name + ".sig")
             if not sig_path.exists():
                 raise ValidationError(
                     f"Package signature is missing for {package_path.name}"
                 )
+            signatures.append(sig_path)
 
-            try:
-                run_cmd(["gpg", "--verify", str(sig_path), str(package_path)])
-            except CommandError as e:
-                raise ValidationError(
-                    f"Package signature verification failed for {package_path.name}: {e}"
-                )
+        # One pacman and one gpg run cover every package
+        names = ", ".join(p.name for p in packages)
+        try:
+            run_cmd([self._tool_pacman, "-Qp", *packages])
+        except CommandError as e:
+            raise ValidationError(f"Package verification failed for {names}: {e}")
+
+        try:
+            # Each signature is checked against the file named without its .sig
+            run_cmd([self._tool_gpg, "--verify-files", *signatures])
+        except CommandError as e:
+            raise ValidationError(
+                f"Package signature verification failed for {names}: {e}"
+            )
 
-            buildinfo_path = Path(str(package_path) + ".buildinfo")
+        for package_path in packages:
+            buildinfo_path = package_path.with_name(package_path.name + ".buildinfo")
             if not buildinfo_path.exists():
                 raise ValidationError(
                     f"Missing .BUILDINFO file for {package_path.name}"
                 )
 
-            buildinfo_content = buildinfo_path.read_text()
-            required_fields = [
-                "format",
-                "pkgname",
-                "pkgver",
-                "pkgarch",
-                "packager",
-                "builddate",
-            ]
-            missing = [
-                field
-                for field in required_fields
-                if not any(
-                    line.startswith(f"{field} = ")
-                    for line in buildinfo_content.splitlines()
-                )
-            ]
+            seen = {
+                line.split(" = ", 1)[0]
+                for line in buildinfo_path.read_text().splitlines()
+                if " = " in line
+            }
+            missing = [field for field in _BUILDINFO_REQUIRED_FIELDS if field not in seen]
             if missing:
                 raise ValidationError(
                     f"Missing required fields in .BUILDINFO for {package_path.name}: {', '.join(missing)}"
@@ -275,7 +412,6 @@ class ArchBuilder:
 
     def cleanup(self) -> None:
         if self.build_dir.exists():
-            try:
-                run_cmd(["rm", "-rf", str(self.build_dir)])
-            except CommandError as e:
-                print(f"Warning: Failed to clean up build directory: {e}")
+            shutil.rmtree(self.build_dir, ignore_errors=True)
+            if self.build_dir.exists():
+                print(f"Warning: Failed to clean up build directory: {self.build_dir}")
@@ -9,6 +9,8 @@ import sys
 from pathlib import Path
 from typing import NoReturn
 
+_PROJECT_ROOT = Path(__file__).parent.parent.parent
+
 def run_command(cmd: list[str], check: bool = True) -> subprocess.CompletedProcess:
     """Run a command and handle errors."""
     try:
@@ -49,7 +51,7 @@ def main() -> NoReturn:
     )
     
     args = parser.parse_args()
-    project_root = Path(__file__).parent.parent.parent
+    project_root = _PROJECT_ROOT
     
     if args.action in ["debian", "void-glibc", "void-musl"]:
         start_builder(args.action, project_root)
@@ -2,6 +2,7 @@
 """Docker control script for Void Linux package building environments."""
 
 import argparse
+import hashlib
 import os
 import subprocess
 import sys
@@ -36,17 +37,23 @@ volumes:
   void-musl-cache:
 """
 
+_DOCKER_DIR = Path(__file__).resolve().parent / "docker"
+_COMPOSE_FILE = _DOCKER_DIR / "docker-compose.yml"
+_COMPOSE_BYTES = COMPOSE_YML.encode()
+_COMPOSE_SHA = hashlib.sha256(_COMPOSE_BYTES).digest()
 
-def ensure_docker_compose():
-    """Ensure docker compose file exists."""
-    docker_dir = Path(__file__).parent / "docker"
-    docker_dir.mkdir(exist_ok=True)
-    compose_file = docker_dir / "docker-compose.yml"
 
-    if not compose_file.exists():
-        compose_file.write_text(COMPOSE_YML)
+def ensure_docker_compose():
+    """Ensure docker compose file exists and matches COMPOSE_YML."""
+    try:
+        if hashlib.sha256(_COMPOSE_FILE.read_bytes()).digest() == _COMPOSE_SHA:
+            return _DOCKER_DIR
+    except FileNotFoundError:
+        pass
 
-    return docker_dir
+    _DOCKER_DIR.mkdir(exist_ok=True)
+    _COMPOSE_FILE.write_bytes(_COMPOSE_BYTES)
+    return _DOCKER_DIR
 
 
 def run_command(cmd: list[str], check: bool = True) -> subprocess.CompletedProcess:
@@ -61,7 +68,7 @@ def run_command(cmd: list[str], check: bool = True) -> subprocess.CompletedProce
 
 def start_container(variant: str):
     """Start and enter a container for the specified variant."""
-    docker_dir = ensure_docker_compose()
+    ensure_docker_compose()
     service = f"void-{variant}"
 
     # Start the container
@@ -70,7 +77,7 @@ def start_container(variant: str):
             "docker",
             "compose",
             "-f",
-            str(docker_dir / "docker-compose.yml"),
+            str(_COMPOSE_FILE),
             "up",
             "-d",
             service,
@@ -89,7 +96,7 @@ def start_container(variant: str):
                 "docker",
                 "compose",
                 "-f",
-                str(docker_dir / "docker-compose.yml"),
+                str(_COMPOSE_FILE),
                 "exec",
                 service,
                 "sh",
@@ -103,8 +110,8 @@ def start_container(variant: str):
 
 def stop_containers(clean: bool = False):
     """Stop containers and optionally remove volumes."""
-    docker_dir = ensure_docker_compose()
-    cmd = ["docker", "compose", "-f", str(docker_dir / "docker-compose.yml"), "down"]
+    ensure_docker_compose()
+    cmd = ["docker", "compose", "-f", str(_COMPOSE_FILE), "down"]
     if clean:
         cmd.append("-v")
     run_command(cmd)
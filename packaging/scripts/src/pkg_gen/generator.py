@@ -3,61 +3,127 @@
 
 from __future__ import annotations
 
+import dataclasses
+import functools
 import getpass
-import subprocess
+import hashlib
+import json
+import os
+import string
+import sys
+from concurrent.futures import (
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+)
 from pathlib import Path
 import tomllib
-from typing import NoReturn
-
-import jinja2
-
-from pkg_gen.errors import BuildError, ConfigError, TemplateError, ValidationError
+from typing import TYPE_CHECKING, Any, NoReturn
+
+from pkg_gen.errors import (
+    BuildError,
+    ConfigError,
+    PackageError,
+    TemplateError,
+    ValidationError,
+)
 from pkg_gen.metadata import PackageMetadata
 from pkg_gen.pkgtypes import PackageConfig
-from pkg_gen.builders import PackageBuilder, get_builder
-from pkg_gen.utils.command import run_cmd, CommandError
+from pkg_gen.builders import get_builder
+from pkg_gen.utils.command import sudo_batch, CommandError
+
+if TYPE_CHECKING:
+    import jinja2
+
+_PACKAGE_FILE_NAMES = {
+    "arch": "PKGBUILD",
+    "deb": "control",
+    "void-glibc": "template",
+    "void-musl": "template",
+}
+
+# Distributions whose package files live in a per-variant subdirectory
+_OUTPUT_SUBDIRS = {
+    "void-glibc": "glibc",
+    "void-musl": "musl",
+}
+
+
+def _write_file(path: Path, data: bytes) -> None:
+    """Write data to path through a raw file descriptor, bypassing Python's I/O stack."""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view) :]
+    finally:
+        os.close(fd)
+
+
+def _claim_dir(directory: Path) -> None:
+    """Give the current user ownership and read/write access to a directory tree."""
+    current_user = getpass.getuser()
+    sudo_batch(
+        [
+            ["chown", "-R", f"{current_user}:{current_user}", directory],
+            ["chmod", "-R", "u+rw,g+rw", directory],  # read/write for user and group
+        ]
+    )
 
 
 class PackageGenerator:
-    def __init__(self, project_root: Path):
+    def __init__(
+        self,
+        project_root: Path,
+        *,
+        claim_build_dir: bool = True,
+        reload_templates: bool = False,
+    ):
+        """
+        Pass claim_build_dir=False when another process already took ownership
+        of the build directory; it may hold a root-owned chroot mid-build.
+        Pass reload_templates=True for long-lived generators, so template edits
+        are picked up instead of rendering from the in-memory copies.
+        """
         self.project_root = project_root
         self.packaging_dir = project_root / "packaging"
         self.templates_dir = self.packaging_dir / "templates"
         self.build_dir = self.packaging_dir / "build"
 
-        self.env = jinja2.Environment(
+        self.config = self._load_config()
+        self._reload_templates = reload_templates
+        self._cargo_deb_tmpl: string.Template | None = None
+        self._prepared_dirs: set[Path] = set()
+        if claim_build_dir:
+            self._setup_build_dir()
+
+    @functools.cached_property
+    def env(self) -> jinja2.Environment:
+        """
+        Jinja environment, created on first use.
+        Build-only runs never render templates, so they skip importing Jinja.
+        """
+        import jinja2
+
+        # Compiled templates persist across runs and worker processes
+        jinja_cache_dir = self.build_dir / ".jinja_cache"
+        jinja_cache_dir.mkdir(parents=True, exist_ok=True)
+        return jinja2.Environment(
             loader=jinja2.FileSystemLoader(self.templates_dir),
             undefined=jinja2.StrictUndefined,
             trim_blocks=True,
             lstrip_blocks=True,
+            # One-shot runs skip the per-lookup mtime check; templates don't change
+            auto_reload=self._reload_templates,
+            cache_size=400,
+            bytecode_cache=jinja2.FileSystemBytecodeCache(str(jinja_cache_dir)),
         )
 
-        self.config = self._load_config()
-        self._setup_build_dir()
-
     def _setup_build_dir(self) -> None:
         """Set up build directory with proper permissions."""
         self.build_dir.mkdir(parents=True, exist_ok=True)
-        current_user = getpass.getuser()
-
-        run_cmd(
-            [
-                "sudo",
-                "chown",
-                "-R",
-                f"{current_user}:{current_user}",
-                str(self.build_dir),
-            ]
-        )
-        run_cmd(
-            [
-                "sudo",
-                "chmod",
-                "-R",
-                "u+rw,g+rw",  # read/write for user and group
-                str(self.build_dir),
-            ]
-        )
+        _claim_dir(self.build_dir)
 
     def _load_config(self) -> PackageConfig:
         """Load and validate configuration."""
@@ -71,6 +137,10 @@ class PackageGenerator:
         self._validate_config(config)
         return config
 
+    def reload_config(self) -> None:
+        """Re-read metadata.toml, for long-lived generators."""
+        self.config = self._load_config()
+
     def _validate_config(self, config: PackageConfig) -> None:
         """Validate the configuration format."""
         required = ["build", "distributions"]
@@ -82,88 +152,312 @@ class PackageGenerator:
         """Get list of supported distributions."""
         return list(self.config["distributions"]["dependencies"].keys())
 
-    def generate_package_files(self, dist_name: str, metadata: PackageMetadata) -> None:
-        """Generate package files for a specific distribution."""
+    def preload_templates(self, dist_names: list[str] | None = None) -> None:
+        """
+        Compile the templates of the given distributions ahead of use, by default
+        those of all supported distributions.
+        Broken or missing templates are skipped; rendering reports them.
+        """
+        import jinja2
+
+        if dist_names is None:
+            dist_names = self.get_supported_distributions()
+        for dist_name in dist_names:
+            try:
+                self.env.get_template(f"{dist_name}.jinja2")
+            except jinja2.TemplateError:
+                continue
+
+    def _get_template(self, dist_name: str) -> jinja2.Template:
+        import jinja2
+
         try:
-            template = self.env.get_template(f"{dist_name}.jinja2")
+            return self.env.get_template(f"{dist_name}.jinja2")
         except jinja2.TemplateNotFound:
             raise TemplateError(f"Template not found for {dist_name}")
 
+    def _template_context(self, metadata: PackageMetadata) -> dict[str, Any]:
+        return {"metadata": metadata, "config": self.config["distributions"]}
+
+    def _prepare_output_dir(self, directory: Path) -> None:
+        """Create an output directory with proper permissions, once per generator."""
+        if directory in self._prepared_dirs:
+            return
+        directory.mkdir(parents=True, exist_ok=True)
+        _claim_dir(directory)
+        self._prepared_dirs.add(directory)
+
+    def _write_package_file(
+        self,
+        dist_name: str,
+        template: jinja2.Template,
+        context: dict[str, Any],
+        metadata: PackageMetadata,
+    ) -> None:
+        import jinja2
+
         output_path = self.get_output_path(dist_name, metadata)
-        output_path.parent.mkdir(parents=True, exist_ok=True)
-
-        # Set directory permissions
-        current_user = getpass.getuser()
-        run_cmd(
-            [
-                "sudo",
-                "chown",
-                "-R",
-                f"{current_user}:{current_user}",
-                str(output_path.parent),
-            ]
-        )
-        run_cmd(
-            [
-                "sudo",
-                "chmod",
-                "-R",
-                "u+rw,g+rw",  # read/write for user and group
-                str(output_path.parent),
-            ]
-        )
+        self._prepare_output_dir(output_path.parent)
 
         try:
-            content = template.render(
-                metadata=metadata, config=self.config["distributions"]
-            )
-            output_path.write_text(content)
+            content = template.render(context)
+            _write_file(output_path, content.encode("utf-8"))
         except jinja2.TemplateError as e:
             raise TemplateError(f"Failed to render template: {e}") from e
 
+        if dist_name == "deb":
+            self.generate_cargo_deb_config(metadata)
+
+    def generate_cargo_deb_config(self, metadata: PackageMetadata) -> None:
+        """Generate the Cargo.deb.toml used by cargo-deb."""
+        if self._cargo_deb_tmpl is None or self._reload_templates:
+            template_path = self.templates_dir / "cargo.deb.toml.tmpl"
+            try:
+                self._cargo_deb_tmpl = string.Template(template_path.read_text())
+            except OSError as e:
+                raise TemplateError(f"Failed to read {template_path.name}: {e}") from e
+
+        try:
+            content = self._cargo_deb_tmpl.substitute(dataclasses.asdict(metadata))
+        except (KeyError, ValueError) as e:
+            raise TemplateError(f"Failed to render Cargo.deb.toml: {e}") from e
+
+        output_path = self.build_dir / "deb" / "Cargo.deb.toml"
+        self._prepare_output_dir(output_path.parent)
+        _write_file(output_path, content.encode("utf-8"))
+
+    def _generate_one(
+        self, dist_name: str, context: dict[str, Any], metadata: PackageMetadata
+    ) -> None:
+        template = self._get_template(dist_name)
+        self._write_package_file(dist_name, template, context, metadata)
+
+    def generate_package_files(self, dist_name: str, metadata: PackageMetadata) -> None:
+        """Generate package files for a specific distribution."""
+        self._generate_one(dist_name, self._template_context(metadata), metadata)
+
+    def generate_all(
+        self, metadata: PackageMetadata, dist_names: list[str]
+    ) -> dict[str, TemplateError]:
+        """
+        Generate package files for several distributions from one shared context.
+        Distributions are rendered and written concurrently.
+        Returns the template errors by distribution; the others are generated.
+        """
+        context = self._template_context(metadata)
+        # The env cached_property has no lock: create it, and compile the templates
+        # into its cache, before the worker threads would each build their own
+        self.preload_templates(dist_names)
+        with ThreadPoolExecutor(max_workers=max(1, len(dist_names))) as executor:
+            futures = {
+                dist_name: executor.submit(
+                    self._generate_one, dist_name, context, metadata
+                )
+                for dist_name in dist_names
+            }
+
+        errors: dict[str, TemplateError] = {}
+        for dist_name, future in futures.items():
+            try:
+                future.result()
+            except TemplateError as e:
+                errors[dist_name] = e
+        return errors
+
     def get_output_path(self, dist_name: str, metadata: PackageMetadata) -> Path:
         """Get the output path for package files."""
         base_dir = self.build_dir / dist_name
 
-        if dist_name.startswith("void-"):
-            base_dir = base_dir / dist_name.split("-")[1]
+        subdir = _OUTPUT_SUBDIRS.get(dist_name)
+        if subdir is not None:
+            base_dir = base_dir / subdir
 
-        return base_dir / self._get_package_file_name(dist_name, metadata)
+        return base_dir / _PACKAGE_FILE_NAMES.get(dist_name, "package.conf")
 
-    def _get_package_file_name(self, dist_name: str, metadata: PackageMetadata) -> str:
-        """Get the appropriate package file name for a distribution."""
-        file_names = {
-            "arch": "PKGBUILD",
-            "deb": "control",
-            "void-glibc": "template",
-            "void-musl": "template",
-        }
-        return file_names.get(dist_name, "package.conf")
-
-    def build_package(self, dist_name: str) -> Path:
-        """Build package for a specific distribution."""
-        metadata = PackageMetadata.from_cargo_toml(
+    def load_metadata(self) -> PackageMetadata:
+        """
+        Load package metadata from Cargo.toml as it is now.
+        The parse is memoized by file mtime and size, so repeated loads are cheap.
+        """
+        return PackageMetadata.from_cargo_toml(
             self.project_root / "Cargo.toml", self.config
         )
 
+    @functools.cached_property
+    def metadata(self) -> PackageMetadata:
+        """Package metadata loaded on first use and kept for one-shot runs."""
+        return self.load_metadata()
+
+    def _inputs_hash(self, dist_name: str) -> str:
+        """Digest every file a build of dist_name depends on."""
+        digest = hashlib.blake2b()
+        inputs = [
+            self.project_root / "Cargo.toml",
+            self.project_root / "Cargo.lock",
+            self.packaging_dir / "config" / "metadata.toml",
+            self.templates_dir / f"{dist_name}.jinja2",
+            *sorted((self.project_root / "src").rglob("*")),
+        ]
+        if dist_name == "deb":
+            # cargo-deb also packages the assets listed in Cargo.deb.toml
+            inputs += [
+                self.templates_dir / "cargo.deb.toml.tmpl",
+                self.project_root / "README.md",
+                self.project_root / "LICENSE",
+            ]
+        for path in inputs:
+            if path.is_file():
+                digest.update(str(path.relative_to(self.project_root)).encode())
+                digest.update(path.read_bytes())
+        return digest.hexdigest()
+
+    def _build_cache_path(self, dist_name: str) -> Path:
+        return self.build_dir / dist_name / ".build-cache.json"
+
+    def _load_build_cache(
+        self, dist_name: str, inputs_hash: str
+    ) -> Path | list[Path] | None:
+        """Return the previous build output if its inputs are unchanged and it still exists."""
+        try:
+            with open(self._build_cache_path(dist_name)) as f:
+                cache = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+        if not isinstance(cache, dict) or cache.get("inputs") != inputs_hash:
+            return None
+
+        package = cache.get("package")
+        if isinstance(package, str):
+            package_path = Path(package)
+            return package_path if package_path.exists() else None
+        if isinstance(package, list):
+            package_paths = [Path(p) for p in package]
+            return package_paths if all(p.exists() for p in package_paths) else None
+        return None
+
+    def _save_build_cache(
+        self, dist_name: str, inputs_hash: str, package_path: Path | list[Path]
+    ) -> None:
+        cache_path = self._build_cache_path(dist_name)
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        if isinstance(package_path, list):
+            package: str | list[str] = [str(p) for p in package_path]
+        else:
+            package = str(package_path)
+        tmp_path = cache_path.with_name(cache_path.name + ".tmp")
+        tmp_path.write_text(json.dumps({"inputs": inputs_hash, "package": package}))
+        os.replace(tmp_path, cache_path)
+
+    def build_package(
+        self,
+        dist_name: str,
+        metadata: PackageMetadata | None = None,
+        generate: bool = True,
+        verify: bool = True,
+    ) -> Path | list[Path]:
+        """
+        Build package for a specific distribution.
+        Pass metadata to reuse metadata already loaded elsewhere; by default
+        the generator's own is used.
+        Pass generate=False when the package files were already generated, and
+        verify=False to leave verification to a later verify_package call.
+        A previous build is reused when none of its inputs changed.
+        """
+        if metadata is None:
+            metadata = self.metadata
+
         builder = get_builder(dist_name, self.project_root)
 
-        # Generate initial package files
-        self.generate_package_files(dist_name, metadata)
+        inputs_hash = self._inputs_hash(dist_name)
+        package_path = self._load_build_cache(dist_name, inputs_hash)
+        if package_path is not None:
+            # stdout carries the JSON replies in serve mode
+            print(f"{dist_name} is up-to-date: {package_path}", file=sys.stderr)
+        else:
+            # Generate initial package files
+            if generate:
+                self.generate_package_files(dist_name, metadata)
+
+            package_path = builder.build(metadata)
+            self._save_build_cache(dist_name, inputs_hash, package_path)
 
-        # Build and verify the package
-        package_path = builder.build(metadata)
-        builder.verify(package_path)
+        if verify:
+            self.verify_package(dist_name, package_path)
 
         return package_path
 
+    def verify_package(self, dist_name: str, package_path: Path | list[Path]) -> None:
+        """
+        Verify a package built for a specific distribution.
+        A package that fails verification is dropped from the build cache.
+        """
+        try:
+            get_builder(dist_name, self.project_root).verify(package_path)
+        except ValidationError:
+            self._build_cache_path(dist_name).unlink(missing_ok=True)
+            raise
+
+
+def _build_one(
+    project_root: Path, dist_name: str, metadata: PackageMetadata
+) -> Path | list[Path] | Exception:
+    """
+    Build a single distribution in a worker process.
+    The parent has already claimed the build directory, so the worker must not.
+    Errors are returned instead of raised so they cross the pool boundary as values.
+    """
+    try:
+        return PackageGenerator(project_root, claim_build_dir=False).build_package(
+            dist_name, metadata, generate=False, verify=False
+        )
+    except Exception as e:
+        # Anything raised here would abort main's result loop, so report it instead
+        return e
+
+
+def _serve_one(generator: PackageGenerator, line: str) -> dict[str, Any]:
+    """Handle one serve request line and return its JSON reply."""
+    try:
+        request = json.loads(line)
+    except json.JSONDecodeError as e:
+        return {"ok": False, "error": f"Invalid request: {e}"}
+    dist_name = request.get("dist") if isinstance(request, dict) else None
+    if not isinstance(dist_name, str):
+        return {"ok": False, "error": 'Invalid request: expected {"dist": "<name>"}'}
+
+    try:
+        # metadata.toml and Cargo.toml may have changed since the server started
+        generator.reload_config()
+        package_path = generator.build_package(dist_name, generator.load_metadata())
+    except (PackageError, CommandError) as e:
+        return {"ok": False, "error": str(e)}
+    return {"ok": True, "package": str(package_path)}
+
+
+def serve(generator: PackageGenerator) -> None:
+    """
+    Build packages requested as JSON lines on stdin, e.g. {"dist": "deb"}.
+    Writes one JSON result line per request to stdout.
+    """
+    generator.preload_templates()
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        print(json.dumps(_serve_one(generator, line)), flush=True)
+
 
 def main() -> NoReturn:
     """CLI entry point."""
     import argparse
-    import sys
 
     parser = argparse.ArgumentParser(description="Generate and build packages")
+    parser.add_argument(
+        "command",
+        nargs="?",
+        choices=["build", "serve"],
+        default="build",
+        help="Build once, or serve build requests read as JSON lines from stdin",
+    )
     parser.add_argument(
         "--distributions",
         default="all",
@@ -174,19 +468,61 @@ def main() -> NoReturn:
     project_root = Path.cwd().parent.parent
 
     try:
-        generator = PackageGenerator(project_root)
+        generator = PackageGenerator(
+            project_root, reload_templates=args.command == "serve"
+        )
+
+        if args.command == "serve":
+            serve(generator)
+            sys.exit(0)
 
         if args.distributions == "all":
             distributions = generator.get_supported_distributions()
         else:
             distributions = args.distributions.split(",")
 
-        for dist in distributions:
-            print(f"\nBuilding package for {dist}...")
-            package_path = generator.build_package(dist)
-            print(f"Package built successfully: {package_path}")
-
-        sys.exit(0)
+        print(f"\nGenerating package files for {', '.join(distributions)}...")
+        metadata = generator.metadata
+        errors = generator.generate_all(metadata, distributions)
+        for dist, error in errors.items():
+            print(f"Error generating files for {dist}: {error}", file=sys.stderr)
+        failed = bool(errors)
+        distributions = [dist for dist in distributions if dist not in errors]
+
+        # Builds run in worker processes; verification of finished packages is
+        # I/O-bound and overlaps with the builds still running.
+        max_workers = max(1, min(len(distributions), os.cpu_count() or 1))
+        verifications: dict[Future[None], tuple[str, Path | list[Path]]] = {}
+        with (
+            ProcessPoolExecutor(max_workers=max_workers) as executor,
+            ThreadPoolExecutor(max_workers=2) as verifier,
+        ):
+            futures = {
+                executor.submit(_build_one, project_root, dist, metadata): dist
+                for dist in distributions
+            }
+            print(f"\nBuilding packages for {', '.join(distributions)}...")
+            for future in as_completed(futures):
+                dist = futures[future]
+                result = future.result()
+                if isinstance(result, Exception):
+                    print(f"Error building {dist}: {result}", file=sys.stderr)
+                    failed = True
+                else:
+                    verification = verifier.submit(generator.verify_package, dist, result)
+                    verifications[verification] = (dist, result)
+
+            for verification in as_completed(verifications):
+                dist, package_path = verifications[verification]
+                try:
+                    verification.result()
+                except (PackageError, CommandError) as e:
+                    print(f"Error verifying {dist}: {e}", file=sys.stderr)
+                    failed = True
+                else:
+                    print(f"Package built successfully for {dist}: {package_path}")
+
+        sys.exit(1 if failed else 0)
 
     except (ConfigError, BuildError, ValidationError, CommandError, TemplateError) as e:
         print(f"Error: {e}", file=sys.stderr)
@@ -3,28 +3,43 @@
 
 from __future__ import annotations
 
+import functools
+import os
 import re
 import tomllib
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Protocol
 
 from pkg_gen.errors import ConfigError
 from pkg_gen.pkgtypes import PackageConfig, CargoToml
 
+_AUTHOR_RE = re.compile(r"(.*?)\s*<(.+?)>")
+
 
 def parse_author(author_str: str) -> tuple[str, str]:
     """
     Parse author string in the format "Name <email>".
     Raises ConfigError if the format is invalid.
     """
-    match = re.match(r"(.*?)\s*<(.+?)>", author_str)
+    match = _AUTHOR_RE.match(author_str)
     if not match:
         raise ConfigError(f"Invalid author format: {author_str}")
     return match.group(1).strip(), match.group(2).strip()
 
 
-@dataclass
+@functools.lru_cache(maxsize=16)
+def _load_cargo_toml(path: Path, mtime_ns: int, size: int) -> CargoToml:
+    """
+    Parse a Cargo.toml file.
+    mtime_ns and size only key the cache, so an edited file is parsed again.
+    """
+    with open(path, "rb") as f:
+        cargo_data: CargoToml = tomllib.load(f)
+    return cargo_data
+
+
+@dataclass(slots=True, frozen=True)
 class PackageMetadata:
     """Metadata for a package, extracted from Cargo.toml and configuration."""
 
@@ -38,11 +53,13 @@ class PackageMetadata:
     homepage: str
     sha256sum: str | None = None
     sha512sum: str | None = None
+    # Formatted as 'name <email>'; derived once since instances are immutable
+    maintainer: str = field(init=False, repr=False, compare=False)
 
-    @property
-    def maintainer(self) -> str:
-        """Format maintainer information as 'name <email>'."""
-        return f"{self.maintainer_name} <{self.maintainer_email}>"
+    def __post_init__(self) -> None:
+        object.__setattr__(
+            self, "maintainer", f"{self.maintainer_name} <{self.maintainer_email}>"
+        )
 
     @classmethod
     def from_cargo_toml(cls, path: Path, dist_config: PackageConfig) -> PackageMetadata:
@@ -51,8 +68,8 @@ class PackageMetadata:
         Raises ConfigError if required fields are missing.
         """
         try:
-            with open(path, "rb") as f:
-                cargo_data: CargoToml = tomllib.load(f)
+            stat = os.stat(path)
+            cargo_data = _load_cargo_toml(path, stat.st_mtime_ns, stat.st_size)
         except tomllib.TOMLDecodeError as e:
             raise ConfigError(f"Invalid Cargo.toml: {e}") from e
         except OSError as e:
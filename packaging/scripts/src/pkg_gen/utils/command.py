@@ -1,10 +1,16 @@
 # src/pkg_gen/utils/command.py
 from __future__ import annotations
 
+import shlex
+import shutil
 import subprocess
 from pathlib import Path
 from typing import Any
 
+from pkg_gen.errors import ConfigError
+
+_LOG_TAIL_BYTES = 4096
+
 
 class CommandError(Exception):
     """Exception raised when a command execution fails."""
@@ -14,8 +20,61 @@ class CommandError(Exception):
         super().__init__(self.message)
 
 
+def require_tool(name: str) -> str:
+    """
+    Resolve an executable on PATH to its absolute path.
+    Raises ConfigError if the tool is not installed.
+    """
+    path = shutil.which(name)
+    if path is None:
+        raise ConfigError(f"Required tool not found on PATH: {name}")
+    return path
+
+
+def _log_tail(log_path: Path) -> str:
+    """Return the last few KiB of a build log."""
+    try:
+        with open(log_path, "rb") as f:
+            f.seek(0, 2)
+            f.seek(max(0, f.tell() - _LOG_TAIL_BYTES))
+            return f.read().decode(errors="replace")
+    except OSError:
+        return ""
+
+
+def run_logged(
+    cmd: list[str | Path],
+    log_path: Path,
+    cwd: Path | str | None = None,
+    env: dict[str, str] | None = None,
+) -> None:
+    """
+    Run a command with stdout and stderr redirected to log_path.
+    Raises CalledProcessError carrying the tail of the log as its output.
+
+    Descriptors are not closed in the child: Python opens its own files
+    non-inheritable, and skipping the close lets CPython use posix_spawn
+    instead of fork+exec when cmd[0] is an absolute path and cwd is None.
+    """
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(log_path, "wb") as log:
+        result = subprocess.run(
+            cmd,
+            cwd=cwd,
+            env=env,
+            stdin=subprocess.DEVNULL,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            close_fds=False,
+        )
+    if result.returncode != 0:
+        raise subprocess.CalledProcessError(
+            result.returncode, cmd, output=_log_tail(log_path)
+        )
+
+
 def run_cmd(
-    cmd: list[str | Path], check: bool = True, **kwargs: Any
+    cmd: list[str | Path], *, check: bool = True, capture: bool = True, **kwargs: Any
 ) -> subprocess.CompletedProcess:
     """
     Execute a command and return its output.
@@ -23,6 +82,8 @@ def run_cmd(
     Args:
         cmd: Command to execute as a list of arguments
         check: If True, raises CommandError on non-zero exit status
+        capture: If True, captures stdout and stderr as text; if False, they are
+            inherited, so long-running commands stream their output
         **kwargs: Additional arguments passed to subprocess.run
 
     Returns:
@@ -33,12 +94,27 @@ def run_cmd(
     """
     try:
         cmd_str = [str(arg) for arg in cmd]
-        return subprocess.run(
-            cmd_str, check=check, capture_output=True, text=True, **kwargs
-        )
+        if capture:
+            kwargs = {"capture_output": True, "text": True, **kwargs}
+        return subprocess.run(cmd_str, check=check, **kwargs)
     except subprocess.CalledProcessError as e:
+        not_captured = "<not captured>"
         error_msg = f"""Command failed: {' '.join(str(x) for x in cmd)}
-stdout: {e.stdout}
-stderr: {e.stderr}
+stdout: {not_captured if e.stdout is None else e.stdout}
+stderr: {not_captured if e.stderr is None else e.stderr}
 return code: {e.returncode}"""
         raise CommandError(error_msg)
+
+
+def sudo_batch(cmds: list[list[str | Path]], **kwargs: Any) -> subprocess.CompletedProcess:
+    """
+    Run several commands under a single sudo invocation.
+
+    The commands are chained with && in one shell, so later commands only run
+    if the earlier ones succeed.
+
+    Raises:
+        CommandError: If any of the commands fails
+    """
+    script = " && ".join(shlex.join(str(arg) for arg in cmd) for cmd in cmds)
+    return run_cmd(["sudo", "sh", "-c", script], **kwargs)